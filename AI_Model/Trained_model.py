@@ -1,25 +1,59 @@
 import pandas as pd
 import numpy as np
 import joblib
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.model_selection import train_test_split
 from sklearn.utils.class_weight import compute_class_weight
-from tensorflow.keras.models import Sequential
+from tensorflow.keras.models import Sequential, load_model
+from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.layers import LSTM, Dense, Dropout
-from tensorflow.keras.callbacks import CSVLogger # <--- NEW TOOL
+from tensorflow.keras.callbacks import CSVLogger, Callback # <--- NEW TOOL
+from tensorflow.keras.utils import PyDataset
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
 
 # --- CONFIGURATION ---
 CSV_FILE_PATH = r'C:\Users\nirad\Downloads\Clima_Route\AI_Model\WeatherDataset.csv'
 MODEL_SAVE_PATH = 'rainfall_model.keras'
 SCALER_SAVE_PATH = 'scaler.gz'
-LOG_FILE = 'training_log.csv' # <--- Where we save the history
+LOG_FILE = 'training_log.csv' # <--- Copy of the latest full run's history
+RUN_LOG_DIR = 'training_logs' # <--- One training_log_<full|incremental>_<run>.csv per run
+RUNS_FILE = 'training_runs.csv' # <--- One row per run: preprocessing + fit durations
+WATERMARK_FILE = 'training_watermark.json' # <--- Last timestamp the model has seen
+
+LOOK_BACK = 24
+FINE_TUNE_EPOCHS = 3
+FINE_TUNE_LR = 1e-4
+FINE_TUNE_VAL_WINDOWS = 168 # Validation windows taken just before the watermark (one week)
+DRIFT_THRESHOLD = 0.10 # Max overshoot of the scaler range (fraction of range) before a full retrain
+DRIFT_HISTORY_LEN = 90 # Runs of drift kept in the watermark file
 
 FEATURE_COLS = ['temperature_2m', 'relative_humidity_2m', 'dew_point_2m', 
                 'surface_pressure', 'cloud_cover', 'wind_speed_10m', 
                 'hour', 'month']
 TARGET_COL = 'rainfall'
 
-def load_and_process_data():
+RUN_ID = datetime.now().strftime('%Y%m%d-%H%M%S')
+RUN_TIMINGS = {} # stage -> seconds, for this run
+
+@contextmanager
+def timed(stage):
+    """Record how long a preprocessing/training stage takes in RUN_TIMINGS"""
+    start = time.perf_counter()
+    yield
+    RUN_TIMINGS[stage] = round(RUN_TIMINGS.get(stage, 0) + time.perf_counter() - start, 3)
+
+def load_dataset():
     print("Loading dataset...")
     df = pd.read_csv(CSV_FILE_PATH, parse_dates=['time'])
     df = df.sort_values(by='time')
@@ -29,6 +63,11 @@ def load_and_process_data():
     df.set_index('time', inplace=True)
     
     df = df[df[TARGET_COL].isin([0, 1, 2])]
+    return df
+
+def load_and_process_data(df=None):
+    if df is None:
+        df = load_dataset()
     
     X = df[FEATURE_COLS].values
     y = df[TARGET_COL].values
@@ -51,6 +90,111 @@ def create_sequences(X_scaled, y, look_back=24):
         y_seq.append(target)
     return np.array(X_seq), np.array(y_seq)
 
+class TimedBatches(PyDataset):
+    """Serves (X, y) in shuffled batches and times how long producing them takes
+
+    Keras pulls batches from here on its own (prefetching) thread, so fetch_time
+    is the real input-pipeline cost, measured apart from the model step.
+    """
+
+    def __init__(self, X, y, batch_size, shuffle=True, **kwargs):
+        super().__init__(**kwargs)
+        self.X, self.y = X, y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(len(X))
+        self.fetch_time = 0.0
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.X) / self.batch_size))
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        idx = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        batch = self.X[idx], self.y[idx]
+        self.fetch_time += time.perf_counter() - start
+        return batch
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+class PerfLogger(Callback):
+    """Adds per-epoch timing and memory columns to the logs (place before CSVLogger)
+
+    - epoch_time_s: wall time of the whole epoch, validation included
+    - step_time_s: time inside train steps (forward + backward, plus any wait
+      for a batch the prefetcher had not produced yet)
+    - input_time_s: time spent producing batches in TimedBatches
+    - loop_overhead_s: time between steps (Keras loop + callbacks)
+    - val_time_s: time from the last train step to the end of the epoch
+    - samples_per_sec: training samples / training wall time (validation excluded)
+    - peak_rss_mb: peak resident memory of this process so far
+    """
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = self.last_batch_end = time.perf_counter()
+        self.step_time = self.overhead_time = 0.0
+        self.fetch_start = self.batches.fetch_time
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+        self.overhead_time += self.batch_start - self.last_batch_end
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.last_batch_end = time.perf_counter()
+        self.step_time += self.last_batch_end - self.batch_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.perf_counter()
+        train_time = self.last_batch_end - self.epoch_start
+        logs['epoch_time_s'] = round(now - self.epoch_start, 3)
+        logs['step_time_s'] = round(self.step_time, 3)
+        logs['input_time_s'] = round(self.batches.fetch_time - self.fetch_start, 3)
+        logs['loop_overhead_s'] = round(self.overhead_time, 3)
+        logs['val_time_s'] = round(now - self.last_batch_end, 3)
+        logs['samples_per_sec'] = round(len(self.batches.X) / train_time, 1) if train_time else 0.0
+        logs['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+def run_log_file(mode):
+    """Per-run CSVLogger path: logs are never appended to or overwritten, so runs can be compared"""
+    os.makedirs(RUN_LOG_DIR, exist_ok=True)
+    return os.path.join(RUN_LOG_DIR, f'training_log_{mode}_{RUN_ID}.csv')
+
+def write_run_summary(mode, log_file, rows, train_samples):
+    """Append one row per run to RUNS_FILE (fixed columns, safe to append)"""
+    summary = pd.DataFrame([{
+        'run_id': RUN_ID,
+        'mode': mode,
+        'log_file': log_file,
+        'rows': rows,
+        'train_samples': train_samples,
+        'load_s': RUN_TIMINGS.get('load', 0.0),
+        'scale_s': RUN_TIMINGS.get('scale', 0.0),
+        'sequences_s': RUN_TIMINGS.get('sequences', 0.0),
+        'fit_s': RUN_TIMINGS.get('fit', 0.0),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }])
+    summary.to_csv(RUNS_FILE, mode='a', header=not os.path.exists(RUNS_FILE), index=False)
+    print(f"Run summary appended to {RUNS_FILE}: {RUN_TIMINGS}")
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB (NaN where unsupported)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return float('nan')
+
 def build_lstm_model(input_shape):
     print("\n--- Building LSTM Architecture ---")
     model = Sequential()
@@ -70,9 +214,45 @@ def build_lstm_model(input_shape):
     
     return model
 
-if __name__ == "__main__":
-    X_scaled, y = load_and_process_data()
-    X_seq, y_seq = create_sequences(X_scaled, y, look_back=24)
+# --- INCREMENTAL (WARM-START) TRAINING ---
+def load_watermark_state():
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+    with open(WATERMARK_FILE) as f:
+        return json.load(f)
+
+def read_watermark():
+    state = load_watermark_state()
+    return pd.Timestamp(state['last_time']) if 'last_time' in state else None
+
+def write_watermark(last_time, mode, rows, drift=None):
+    """Persist the watermark plus the scaler drift measured for this run (drift = (max, per_feature))"""
+    state = load_watermark_state()
+    history = state.get('drift_history', [])
+    state.update({'last_time': str(last_time), 'mode': mode, 'rows': int(rows)})
+    if drift is not None:
+        max_drift, per_feature = drift
+        state['drift'] = max_drift
+        state['drift_per_feature'] = {k: float(v) for k, v in per_feature.items()}
+        history.append({'last_time': str(last_time), 'mode': mode, 'drift': max_drift})
+        state['drift_history'] = history[-DRIFT_HISTORY_LEN:]
+    with open(WATERMARK_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+    print(f"Watermark set to {last_time}")
+
+def scaler_drift(scaler, X_new):
+    """How far new data falls outside the fitted scaler range, as a fraction of that range"""
+    data_range = np.where(scaler.data_range_ == 0, 1, scaler.data_range_)
+    below = (scaler.data_min_ - X_new.min(axis=0)) / data_range
+    above = (X_new.max(axis=0) - scaler.data_max_) / data_range
+    per_feature = np.maximum(np.maximum(below, above), 0)
+    return float(per_feature.max()), dict(zip(FEATURE_COLS, per_feature.round(4)))
+
+def train_full(df, drift=None):
+    with timed('scale'):
+        X_scaled, y = load_and_process_data(df)
+    with timed('sequences'):
+        X_seq, y_seq = create_sequences(X_scaled, y, look_back=LOOK_BACK)
     
     X_train, X_test, y_train, y_test = train_test_split(X_seq, y_seq, test_size=0.2, shuffle=False)
     
@@ -86,16 +266,101 @@ if __name__ == "__main__":
     print("\n--- Starting Deep Training ---")
     
     # This 'callback' saves the accuracy to a file every epoch
-    csv_logger = CSVLogger(LOG_FILE, append=False)
+    log_file = run_log_file('full')
+    csv_logger = CSVLogger(log_file, append=False)
+    batches = TimedBatches(X_train, y_train, batch_size=1024)
     
-    model.fit(X_train, y_train, 
-              epochs=10, 
-              batch_size=1024, 
-              validation_data=(X_test, y_test),
-              class_weight=class_weight_dict,
-              callbacks=[csv_logger]) # <--- We added the logger here
+    with timed('fit'):
+        model.fit(batches, 
+                  epochs=10, 
+                  validation_data=(X_test, y_test),
+                  class_weight=class_weight_dict,
+                  callbacks=[PerfLogger(batches), csv_logger]) # <--- We added the logger here
     
     print(f"\n--- Saving Model to {MODEL_SAVE_PATH} ---")
     model.save(MODEL_SAVE_PATH)
-    print("Training Complete. Logs saved to 'training_log.csv'.")
-    
\ No newline at end of file
+    write_watermark(df.index.max(), 'full', len(df), drift)
+    shutil.copyfile(log_file, LOG_FILE)
+    write_run_summary('full', log_file, len(df), len(X_train))
+    print(f"Training Complete. Logs saved to '{log_file}' (latest copy in '{LOG_FILE}').")
+
+def train_incremental(df):
+    """Fine-tune the saved model on rows newer than the watermark; full retrain on drift"""
+    watermark = read_watermark()
+    if watermark is None or not (os.path.exists(MODEL_SAVE_PATH) and os.path.exists(SCALER_SAVE_PATH)):
+        print("No watermark or saved model found -> full retrain")
+        return train_full(df)
+    
+    new_mask = df.index > watermark
+    n_new = int(new_mask.sum())
+    if n_new == 0:
+        print(f"No new rows since {watermark}. Nothing to do.")
+        return
+    print(f"\n--- Incremental Training: {n_new} new rows since {watermark} ---")
+    
+    scaler = joblib.load(SCALER_SAVE_PATH)
+    X_new = df.loc[new_mask, FEATURE_COLS].values
+    drift = scaler_drift(scaler, X_new)
+    print(f"Scaler drift: {drift[0]:.3f} (threshold {DRIFT_THRESHOLD}) {drift[1]}")
+    if drift[0] > DRIFT_THRESHOLD:
+        print("Drift too large for the saved scaler -> full retrain")
+        return train_full(df, drift)
+    
+    # Train on every new window: the watermark moves past all new rows, so holding the
+    # newest ones out for validation would mean they are never trained on. Validate on
+    # the windows just before the watermark instead (same size every run, so comparable).
+    # The LOOK_BACK extra old rows let the first windows span the boundary.
+    boundary = int(np.argmax(new_mask))
+    n_val = min(FINE_TUNE_VAL_WINDOWS, max(0, boundary - LOOK_BACK))
+    start = max(0, boundary - LOOK_BACK - n_val)
+    tail = df.iloc[start:]
+    with timed('scale'):
+        X_scaled = scaler.transform(tail[FEATURE_COLS].values)
+    with timed('sequences'):
+        X_seq, y_seq = create_sequences(X_scaled, tail[TARGET_COL].values, look_back=LOOK_BACK)
+    X_train, y_train = X_seq[n_val:], y_seq[n_val:]
+    if len(X_train) == 0:
+        print(f"Not enough rows for a {LOOK_BACK}h window yet. Nothing to do.")
+        return
+    validation_data = (X_seq[:n_val], y_seq[:n_val]) if n_val else None
+    
+    classes = np.unique(y_train)
+    class_weights = compute_class_weight(class_weight='balanced', classes=classes, y=y_train)
+    class_weight_dict = dict(zip(classes.astype(int), class_weights))
+    
+    model = load_model(MODEL_SAVE_PATH)
+    # Low learning rate: adapt to the new hours without forgetting the old ones
+    model.compile(optimizer=Adam(learning_rate=FINE_TUNE_LR),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+    
+    # Own file per run: appending would misalign columns (val_* only exist with a
+    # validation split) and overwriting would lose earlier nights for comparison
+    log_file = run_log_file('incremental')
+    csv_logger = CSVLogger(log_file, append=False)
+    batches = TimedBatches(X_train, y_train, batch_size=1024)
+    with timed('fit'):
+        model.fit(batches,
+                  epochs=FINE_TUNE_EPOCHS,
+                  validation_data=validation_data,
+                  class_weight=class_weight_dict,
+                  callbacks=[PerfLogger(batches), csv_logger])
+    
+    print(f"\n--- Saving Model to {MODEL_SAVE_PATH} ---")
+    model.save(MODEL_SAVE_PATH)
+    write_watermark(df.index.max(), 'incremental', n_new, drift)
+    write_run_summary('incremental', log_file, n_new, len(X_train))
+    print("Incremental Training Complete.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the rainfall LSTM')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Fine-tune the saved model on rows newer than the watermark')
+    args = parser.parse_args()
+    
+    with timed('load'):
+        df = load_dataset()
+    if args.incremental:
+        train_incremental(df)
+    else:
+        train_full(df)
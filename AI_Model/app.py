@@ -4,6 +4,11 @@ import requests
 import joblib
 import os
 import sys
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 try:
@@ -25,23 +30,108 @@ FEATURE_COLS = ['temperature_2m', 'relative_humidity_2m', 'dew_point_2m',
                 'surface_pressure', 'cloud_cover', 'wind_speed_10m', 
                 'hour', 'month']
 
+# Inference pool: each worker process holds its own model, so pandas + predict
+# run in parallel instead of queueing on the GIL. AI_WORKERS=0 runs inline.
+# Default: the cores this process may use (cgroup/affinity aware), capped because
+# every worker holds its own TensorFlow + model (~500 MB).
+MAX_DEFAULT_WORKERS = 4
+_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+AI_WORKERS = int(os.environ.get('AI_WORKERS', min(_cores, MAX_DEFAULT_WORKERS)))
+MAX_PENDING = int(os.environ.get('AI_MAX_PENDING', AI_WORKERS * 4))  # bounded queue
+QUEUE_TIMEOUT = float(os.environ.get('AI_QUEUE_TIMEOUT', 2))  # seconds to wait for a slot
+INFERENCE_TIMEOUT = float(os.environ.get('AI_INFERENCE_TIMEOUT', 15))  # seconds per call
+WEATHER_TIMEOUT = float(os.environ.get('WEATHER_TIMEOUT', 10))
+
+class InferenceBusy(Exception):
+    """Raised when the inference queue is full"""
+
+class InferenceTimeout(Exception):
+    """Raised when a worker does not answer within INFERENCE_TIMEOUT"""
+
 # --- LOAD MODEL ---
-print("⏳ Loading AI Model...")
 model = None
 scaler = None
 
-if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH) and load_model is not None:
-    try:
-        model = load_model(MODEL_PATH)
-        scaler = joblib.load(SCALER_PATH)
-        print("✅ Model & Scaler Loaded!")
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
-else:
-    if not (os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH)):
-        print("⚠️ Model files not found. Ensure rainfall_model.keras and scaler.gz are in this folder.")
+def load_ai_model():
+    """Load model & scaler into this process"""
+    global model, scaler
+    print(f"⏳ Loading AI Model... (pid {os.getpid()})")
+    if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH) and load_model is not None:
+        try:
+            model = load_model(MODEL_PATH)
+            scaler = joblib.load(SCALER_PATH)
+            print("✅ Model & Scaler Loaded!")
+        except Exception as e:
+            print(f"❌ Error loading model: {e}")
     else:
-        print("⚠️ TensorFlow not installed; model loading skipped. Install TensorFlow to enable predictions.")
+        if not (os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH)):
+            print("⚠️ Model files not found. Ensure rainfall_model.keras and scaler.gz are in this folder.")
+        else:
+            print("⚠️ TensorFlow not installed; model loading skipped. Install TensorFlow to enable predictions.")
+
+def _init_worker():
+    """Pool initializer: one model per worker process, single-threaded TF"""
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception:
+        pass
+    load_ai_model()
+
+# Only the web process loads the model itself when running without a pool
+if AI_WORKERS == 0 and multiprocessing.current_process().name == 'MainProcess':
+    load_ai_model()
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(max(1, MAX_PENDING))
+
+def get_pool():
+    """Create the process pool on first use (spawn: TensorFlow is not fork-safe).
+    Workers are started (models loaded) before the pool is handed out, so a restart
+    never counts against a request's INFERENCE_TIMEOUT."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            print(f"🚀 Starting inference pool with {AI_WORKERS} worker processes")
+            pool = ProcessPoolExecutor(
+                max_workers=AI_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+            try:
+                for future in [pool.submit(os.getpid) for _ in range(AI_WORKERS)]:
+                    future.result()
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            _pool = pool
+        return _pool
+
+def warm_pool():
+    """Start every worker (and load its model) before the first request arrives"""
+    get_pool()
+
+def _reset_pool(broken_pool):
+    """Drop a broken pool; only if it is still current, so a fresh pool is never shut down"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken_pool:
+            _pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def _recycle_pool(hung_pool):
+    """Kill a pool whose worker hangs. Its running jobs then fail with BrokenProcessPool
+    and queued ones are cancelled, so every done-callback releases its slot."""
+    for process in list((hung_pool._processes or {}).values()):
+        process.terminate()
+    _reset_pool(hung_pool)
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
 
 # --- HELPER: Fetch Weather ---
 def get_real_weather(lat, lon):
@@ -53,7 +143,7 @@ def get_real_weather(lat, lon):
         "past_days": 1, "forecast_days": 1, "timezone": "auto"
     }
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=WEATHER_TIMEOUT)
         return response.json()
     except:
         return None
@@ -66,14 +156,10 @@ def get_weather_desc(code):
     return "Clear"
 
 # --- SHARED PREDICTION LOGIC ---
-def calculate_risk(lat, lon):
-    # 1. Get Data
-    data = get_real_weather(lat, lon)
-    if not data or 'hourly' not in data:
-        return None
-
-    # 2. Process for Model
-    df = pd.DataFrame(data['hourly'])
+def predict_rain_prob(hourly):
+    """Feature building + inference; runs inside a pool worker (or inline)"""
+    # 1. Process for Model
+    df = pd.DataFrame(hourly)
     df['time'] = pd.to_datetime(df['time'])
     current_time = datetime.now()
     
@@ -82,7 +168,7 @@ def calculate_risk(lat, lon):
     while len(df) < 24: # Pad if needed
         df = pd.concat([df, df.iloc[[-1]]], ignore_index=True)
 
-    # 3. Predict
+    # 2. Predict
     rain_prob = 0
     if model and scaler:
         df['hour'] = df['time'].dt.hour
@@ -100,7 +186,54 @@ def calculate_risk(lat, lon):
         # Calculate Rain Prob (Sum of non-zero classes)
         rain_prob = float(probs[1] + probs[2]) * 100 if len(probs) > 2 else float(probs[0]) * 100
 
-    # 4. Extract Current Details
+    return rain_prob
+
+def run_inference(hourly):
+    """Send one inference job to the pool, bounded by MAX_PENDING and INFERENCE_TIMEOUT"""
+    if AI_WORKERS == 0:
+        return predict_rain_prob(hourly)
+
+    if not _pool_slots.acquire(timeout=QUEUE_TIMEOUT):
+        raise InferenceBusy()
+    pool = None
+    try:
+        pool = get_pool()
+        future = pool.submit(predict_rain_prob, hourly)
+    except (BrokenProcessPool, RuntimeError):
+        # A worker died while idle (e.g. OOM kill), another thread already replaced the
+        # pool, or a fresh pool failed to start
+        _pool_slots.release()
+        print("❌ Inference pool unusable; restarting pool")
+        if pool is not None:
+            _reset_pool(pool)
+        raise InferenceBusy()
+
+    # Keep the slot until the job really ends: a timed-out job still occupies a worker
+    future.add_done_callback(lambda _: _pool_slots.release())
+    try:
+        return future.result(timeout=INFERENCE_TIMEOUT)
+    except FutureTimeout:
+        # cancel() can't stop a running job: recycle the pool, or a hung predict would
+        # hold a worker and a slot forever
+        print(f"❌ Inference took over {INFERENCE_TIMEOUT}s; restarting pool")
+        _recycle_pool(pool)
+        raise InferenceTimeout()
+    except BrokenProcessPool:
+        # A worker died mid-job; start a fresh pool for the next call
+        print("❌ Inference worker crashed; restarting pool")
+        _reset_pool(pool)
+        raise InferenceBusy()
+
+def calculate_risk(lat, lon):
+    # 1. Get Data (network I/O stays in the web thread; it releases the GIL)
+    data = get_real_weather(lat, lon)
+    if not data or 'hourly' not in data:
+        return None
+
+    # 2. Predict in a worker process
+    rain_prob = run_inference(data['hourly'])
+
+    # 3. Extract Current Details
     curr = data.get('current', {})
     
     return {
@@ -114,6 +247,16 @@ def calculate_risk(lat, lon):
 
 # --- ENDPOINTS ---
 
+@app.errorhandler(InferenceBusy)
+def handle_busy(e):
+    response = jsonify({"error": "AI Server is busy, retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(InferenceTimeout)
+def handle_timeout(e):
+    return jsonify({"error": "Prediction timed out"}), 504
+
 @app.route('/predict_score', methods=['POST'])
 def predict_score():
     """ Used by RouteController for Path Scoring """
@@ -215,9 +358,12 @@ if __name__ == '__main__':
         from waitress import serve
         print("🚀 Starting Production Server (Waitress)...")
         print("📡 AI Model API running on http://127.0.0.1:5001")
-        print("👥 Multi-user support: ENABLED (4 threads)")
-        # threads=4 allows 4 concurrent requests, adjust as needed
-        serve(app, host='0.0.0.0', port=5001, threads=4)
+        # Threads mostly wait on Open-Meteo; inference runs in the process pool
+        threads = max(4, AI_WORKERS * 2)
+        print(f"👥 Multi-user support: ENABLED ({threads} threads, {AI_WORKERS} inference processes)")
+        if AI_WORKERS:
+            warm_pool()
+        serve(app, host='0.0.0.0', port=5001, threads=threads)
     except ImportError:
         print("⚠️ Waitress not installed. Falling back to Flask dev server.")
         print("⚠️ Run: pip install waitress")
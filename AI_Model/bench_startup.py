@@ -0,0 +1,117 @@
+"""
+Startup benchmark for the gunicorn preload mode
+
+Starts gunicorn with 1, 4 and 8 workers (preload on and off), waits until
+every worker has logged "Worker ready", then reports time-to-ready plus
+total RSS and PSS of the master + workers. PSS splits shared pages
+between processes, so it shows what copy-on-write sharing actually saves;
+RSS counts shared pages once per process.
+
+Usage (Linux only, reads /proc):
+    python bench_startup.py --workers 1 4 8
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_mem_kb(pid):
+    """Return (rss_kb, pss_kb) for one process"""
+    rss = pss = 0
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1])
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return rss, pss
+
+
+def child_pids(pid):
+    """Direct children of a process"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def wait_ready(proc, workers, deadline):
+    """Block until every worker logged "Worker ready"; False on timeout/crash"""
+    ready = []
+    done = threading.Event()
+
+    def watch_log():
+        for line in proc.stderr:
+            if "Worker ready" in line:
+                ready.append(line)
+                if len(ready) >= workers:
+                    done.set()
+
+    threading.Thread(target=watch_log, daemon=True).start()
+
+    while time.time() < deadline:
+        if done.wait(0.1):
+            return True
+        if proc.poll() is not None:
+            return False
+    return False
+
+
+def run_once(workers, preload, port, timeout):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers),
+               PRELOAD_MODEL="1" if preload else "0",
+               BIND=f"127.0.0.1:{port}")
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=BASE_DIR, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True
+    )
+    try:
+        if not wait_ready(proc, workers, start + timeout):
+            return None
+        elapsed = time.time() - start
+        pids = [proc.pid] + child_pids(proc.pid)
+        rss = pss = 0
+        for pid in pids:
+            r, p = read_mem_kb(pid)
+            rss += r
+            pss += p
+        return elapsed, rss / 1024, pss / 1024
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AI service startup')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 8], help='Worker counts to test')
+    parser.add_argument('--port', default=5099, type=int, help='Port to bind during the benchmark')
+    parser.add_argument('--timeout', default=300, type=int, help='Seconds to wait for readiness')
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'preload':>7} {'ready (s)':>10} {'RSS (MB)':>10} {'PSS (MB)':>10}")
+    for workers in args.workers:
+        for preload in (True, False):
+            result = run_once(workers, preload, args.port, args.timeout)
+            if result is None:
+                print(f"{workers:>7} {str(preload):>7} {'failed':>10}")
+                continue
+            elapsed, rss, pss = result
+            print(f"{workers:>7} {str(preload):>7} {elapsed:>10.1f} {rss:>10.0f} {pss:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
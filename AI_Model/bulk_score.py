@@ -0,0 +1,364 @@
+"""
+Bulk fleet scoring with columnar I/O
+
+Scores thousands of points (vehicle positions or planned route points) in
+one go instead of one /predict_score POST per point:
+- Input/output: Parquet, Arrow IPC or msgpack (columns: lat, lon, optional time)
+- Locations are rounded and deduplicated before fetching weather
+- Open-Meteo is queried for many locations per request, several requests at once
+- All windows are scaled and predicted as one large batch
+- Weather calls respect the request deadline: skipped once it has passed,
+  otherwise their timeout is capped at the time left
+
+Used by the /bulk_score endpoint in main.py and as an offline CLI:
+    python bulk_score.py positions.parquet scored.parquet
+"""
+
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+HOURLY_VARS = "temperature_2m,relative_humidity_2m,dew_point_2m,surface_pressure,cloud_cover,wind_speed_10m,weather_code"
+FETCH_WORKERS = int(os.environ.get('BULK_FETCH_WORKERS', 8))
+FETCH_TIMEOUT = 30  # seconds per Open-Meteo call, lowered to the deadline's remaining time
+LOCATIONS_PER_REQUEST = int(os.environ.get('BULK_LOCATIONS_PER_REQUEST', 50))
+PREDICT_BATCH_SIZE = int(os.environ.get('BULK_PREDICT_BATCH_SIZE', 1024))
+MAX_POINTS = int(os.environ.get('BULK_MAX_POINTS', 100000))  # per /bulk_score request
+MAX_BODY_BYTES = int(os.environ.get('BULK_MAX_BODY_BYTES', 32 * 1024 * 1024))
+COORD_DECIMALS = 2  # ~1 km, finer than the weather model grid
+LOOK_BACK = 24
+
+FORMATS = ('parquet', 'arrow', 'msgpack')
+CONTENT_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'msgpack': 'application/msgpack',
+}
+
+
+class BulkInputError(ValueError):
+    """Raised for malformed or unsupported bulk input"""
+
+class BulkTooLarge(BulkInputError):
+    """Raised when a request exceeds MAX_POINTS or MAX_BODY_BYTES"""
+
+
+# --- COLUMNAR I/O ---
+def format_from_content_type(content_type: str) -> Optional[str]:
+    """Map an HTTP Content-Type to one of FORMATS"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    for fmt, ctype in CONTENT_TYPES.items():
+        if content_type == ctype:
+            return fmt
+    if content_type in ('application/x-parquet', 'application/parquet'):
+        return 'parquet'
+    if content_type in ('application/x-msgpack', 'application/vnd.msgpack'):
+        return 'msgpack'
+    return None
+
+def format_from_path(path: str) -> str:
+    """Guess the format from a file extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.arrow', '.feather', '.ipc', '.arrows'):
+        return 'arrow'
+    if ext in ('.msgpack', '.mpk'):
+        return 'msgpack'
+    raise BulkInputError(f"Unknown file extension: {ext}")
+
+def _require(fmt: str):
+    if fmt in ('parquet', 'arrow') and pa is None:
+        raise BulkInputError("pyarrow is not installed; run: pip install pyarrow")
+    if fmt == 'msgpack' and msgpack is None:
+        raise BulkInputError("msgpack is not installed; run: pip install msgpack")
+
+def decode(payload: bytes, fmt: str) -> pd.DataFrame:
+    """Decode columnar bytes into a DataFrame with lat, lon and optional time"""
+    _require(fmt)
+    try:
+        df = _decode_frame(payload, fmt)
+    except BulkInputError:
+        raise
+    # pyarrow's ArrowInvalid and msgpack's unpack errors are ValueErrors
+    except (ValueError, TypeError, OSError, NotImplementedError) as e:
+        raise BulkInputError(f"Malformed {fmt} body: {str(e) or type(e).__name__}") from e
+    return _normalise(df)
+
+def _decode_frame(payload: bytes, fmt: str) -> pd.DataFrame:
+    if fmt == 'parquet':
+        df = pq.read_table(pa.BufferReader(payload)).to_pandas()
+    elif fmt == 'arrow':
+        try:
+            df = ipc.open_stream(payload).read_pandas()
+        except pa.ArrowInvalid:
+            df = ipc.open_file(payload).read_pandas()
+    elif fmt == 'msgpack':
+        data = msgpack.unpackb(payload, raw=False)
+        if isinstance(data, dict):
+            # Columnar: {"lat": [...], "lon": [...], "time": [...]}
+            df = pd.DataFrame(data)
+        elif isinstance(data, list):
+            # Row-wise: [[lat, lon], [lat, lon, time], ...]
+            width = max((len(row) for row in data), default=2)
+            if width > 3:
+                raise BulkInputError("msgpack rows must be [lat, lon] or [lat, lon, time]")
+            df = pd.DataFrame(data, columns=['lat', 'lon', 'time'][:width])
+        else:
+            raise BulkInputError("msgpack payload must be a map of columns or an array of rows")
+    else:
+        raise BulkInputError(f"Unsupported format: {fmt}")
+    return df
+
+def _normalise(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={'latitude': 'lat', 'longitude': 'lon'})
+    if 'lat' not in df.columns or 'lon' not in df.columns:
+        raise BulkInputError("Input needs 'lat' and 'lon' columns")
+    return df
+
+def encode(df: pd.DataFrame, fmt: str) -> bytes:
+    """Encode a DataFrame into columnar bytes"""
+    _require(fmt)
+    if fmt == 'parquet':
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink)
+        return sink.getvalue().to_pybytes()
+    if fmt == 'arrow':
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if fmt == 'msgpack':
+        columns = {}
+        for col in df.columns:
+            values = df[col]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                values = values.astype('int64') // 10**9
+            columns[col] = [None if pd.isna(v) else v for v in values.tolist()]
+        return msgpack.packb(columns, use_bin_type=True)
+    raise BulkInputError(f"Unsupported format: {fmt}")
+
+def read_file(path: str) -> pd.DataFrame:
+    fmt = format_from_path(path)
+    if fmt == 'arrow':
+        _require(fmt)
+        return _normalise(feather.read_table(path).to_pandas())
+    with open(path, 'rb') as f:
+        return decode(f.read(), fmt)
+
+def write_file(df: pd.DataFrame, path: str):
+    fmt = format_from_path(path)
+    if fmt == 'arrow':
+        _require(fmt)
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), path)
+        return
+    with open(path, 'wb') as f:
+        f.write(encode(df, fmt))
+
+
+# --- WEATHER FETCH ---
+def _fetch_chunk(session: requests.Session, coords: list, deadline: Optional[float] = None) -> Optional[list]:
+    """Fetch hourly weather for up to LOCATIONS_PER_REQUEST locations in one call.
+    deadline is an absolute time.monotonic(); returns None if it passed before the call"""
+    timeout = FETCH_TIMEOUT
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        timeout = min(FETCH_TIMEOUT, remaining)
+    params = {
+        "latitude": ",".join(str(lat) for lat, _ in coords),
+        "longitude": ",".join(str(lon) for _, lon in coords),
+        "hourly": HOURLY_VARS,
+        "past_days": 1,
+        "forecast_days": 2,
+        "timezone": "auto"  # local hours, same features as /predict_score
+    }
+    try:
+        response = session.get(WEATHER_URL, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        # A single location comes back as an object, several as a list
+        return data if isinstance(data, list) else [data]
+    except Exception as e:
+        logger.error(f"Bulk weather API error ({len(coords)} locations): {e}")
+        return [None] * len(coords)
+
+def fetch_weather(coords: list, deadline: Optional[float] = None) -> tuple:
+    """Fetch hourly weather for unique coordinates concurrently
+    -> ({coord: (hourly dict, utc offset s)}, coords skipped because the deadline passed)"""
+    chunks = [coords[i:i + LOCATIONS_PER_REQUEST] for i in range(0, len(coords), LOCATIONS_PER_REQUEST)]
+    weather, skipped = {}, set()
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        for chunk, results in zip(chunks, pool.map(lambda c: _fetch_chunk(session, c, deadline), chunks)):
+            if results is None:
+                skipped.update(chunk)
+                continue
+            for coord, data in zip(chunk, results):
+                if data and 'hourly' in data:
+                    weather[coord] = (data['hourly'], data.get('utc_offset_seconds', 0))
+    if skipped:
+        logger.warning(f"Skipped weather for {len(skipped)} locations: deadline passed")
+    return weather, skipped
+
+
+# --- SCORING ---
+def _build_window(hourly: pd.DataFrame, features: np.ndarray, at: np.datetime64) -> Optional[tuple]:
+    """24h feature window ending at `at` (padded with the last row), plus its weather code.
+    None if `at` lies outside the fetched hours (1 day back, 2 days ahead)"""
+    hours = hourly['time'].values
+    if at < hours[0] or at >= hours[-1] + np.timedelta64(1, 'h'):
+        return None
+    end = int(np.searchsorted(hours, at, side='right'))
+    window = features[max(0, end - LOOK_BACK):end]
+    if len(window) < LOOK_BACK:
+        window = np.vstack([window, np.repeat(window[-1:], LOOK_BACK - len(window), axis=0)])
+    return window, hourly['weather_code'].iloc[end - 1]
+
+def score_points(df: pd.DataFrame, model, scaler, deadline: Optional[float] = None) -> tuple:
+    """Score every row of df (lat, lon, optional time)
+    -> (result columns, locations skipped because the deadline passed)"""
+    from main import FEATURE_COLS, get_weather_desc
+
+    now = np.datetime64(pd.Timestamp.now(tz='UTC').tz_localize(None))
+    lats = pd.to_numeric(df['lat'], errors='coerce').to_numpy(dtype=float)
+    lons = pd.to_numeric(df['lon'], errors='coerce').to_numpy(dtype=float)
+    # One bad coordinate would make Open-Meteo reject its whole multi-location request
+    valid = np.isfinite(lats) & np.isfinite(lons) & (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+    if 'time' in df.columns:
+        times = df['time']
+        try:
+            if pd.api.types.is_numeric_dtype(times):
+                times = pd.to_datetime(times, unit='s', utc=True)
+            else:
+                times = pd.to_datetime(times, utc=True)
+        except (ValueError, TypeError, OverflowError) as e:
+            raise BulkInputError(f"Could not parse the 'time' column: {e}") from e
+        times = times.dt.tz_localize(None).fillna(now).to_numpy()
+    else:
+        times = np.full(len(df), now)
+
+    keys = list(zip(np.round(lats, COORD_DECIMALS), np.round(lons, COORD_DECIMALS)))
+    unique = list(dict.fromkeys(key for key, ok in zip(keys, valid) if ok))
+    weather, skipped = fetch_weather(unique, deadline)
+
+    # Prepare feature matrices once per unique location (hourly times are location-local)
+    prepared = {}
+    for key, (hourly, utc_offset) in weather.items():
+        hdf = pd.DataFrame(hourly)
+        hdf['time'] = pd.to_datetime(hdf['time'])
+        hdf = hdf.sort_values('time').ffill().reset_index(drop=True)
+        hdf['hour'] = hdf['time'].dt.hour
+        hdf['month'] = hdf['time'].dt.month
+        prepared[key] = (hdf, hdf[FEATURE_COLS].to_numpy(dtype=float), np.timedelta64(int(utc_offset), 's'))
+
+    rows, windows, codes = [], [], []
+    out_of_range = np.zeros(len(df), dtype=bool)
+    for i, key in enumerate(keys):
+        if not valid[i] or key not in prepared:
+            continue
+        hdf, features, utc_offset = prepared[key]
+        # Point times are UTC; shift into the location's local time like the hourly data
+        built = _build_window(hdf, features, times[i] + utc_offset)
+        if built is None:
+            out_of_range[i] = True
+            continue
+        window, code = built
+        rows.append(i)
+        windows.append(window)
+        codes.append(code)
+
+    rain_prob = np.full(len(df), np.nan)
+    condition = np.full(len(df), None, dtype=object)
+    if rows:
+        batch = np.stack(windows)
+        n, steps, width = batch.shape
+        batch = scaler.transform(batch.reshape(-1, width)).reshape(n, steps, width)
+        try:
+            probs = model.predict(batch, batch_size=PREDICT_BATCH_SIZE, verbose=0)
+        except Exception:
+            # Fallback to 2D (Dense)
+            probs = model.predict(batch[:, -1, :], batch_size=PREDICT_BATCH_SIZE, verbose=0)
+        probs = probs[:, 1] + probs[:, 2] if probs.shape[1] > 2 else probs[:, 0]
+        rain_prob[rows] = np.round(probs.astype(float) * 100, 2)
+        condition[rows] = [get_weather_desc(int(c) if pd.notna(c) else 0) for c in codes]
+
+    out = pd.DataFrame({'lat': lats, 'lon': lons})
+    if 'time' in df.columns:
+        out['time'] = df['time'].to_numpy()
+    out['safety_score'] = np.round(np.maximum(0, 100 - rain_prob), 1)
+    out['rain_prob'] = rain_prob
+    out['condition'] = condition
+    late = np.array([key in skipped for key in keys], dtype=bool)
+    out['error'] = np.select(
+        [~valid, late, out_of_range, np.isnan(rain_prob)],
+        ['invalid coordinates', 'deadline exceeded', 'time out of range', 'weather unavailable'],
+        default=None
+    )
+    return out, len(skipped)
+
+def score_bytes(payload: bytes, fmt: str, model, scaler, deadline: Optional[float] = None) -> tuple:
+    """Decode, score and encode in one go -> (bytes, points, points_per_second, locations skipped)"""
+    start = time.perf_counter()
+    df = decode(payload, fmt)
+    if len(df) > MAX_POINTS:
+        raise BulkTooLarge(f"{len(df)} points exceeds the limit of {MAX_POINTS} per request")
+    result, skipped = score_points(df, model, scaler, deadline)
+    encoded = encode(result, fmt)
+    elapsed = time.perf_counter() - start
+    rate = len(df) / elapsed if elapsed > 0 else 0.0
+    logger.info(f"📦 Bulk scored {len(df)} points in {elapsed:.2f}s ({rate:.0f} points/s)")
+    return encoded, len(df), rate, skipped
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-score lat/lon(/time) points offline')
+    parser.add_argument('input', help='Input file (.parquet, .arrow/.feather, .msgpack)')
+    parser.add_argument('output', help='Output file; format follows the extension')
+    args = parser.parse_args()
+
+    import main as service
+
+    print("⏳ Loading AI Model...")
+    if not service.load_model_store():
+        raise SystemExit("❌ Model could not be loaded")
+
+    start = time.perf_counter()
+    df = read_file(args.input)
+    result, _ = score_points(df, service.model_store.model, service.model_store.scaler)
+    write_file(result, args.output)
+    elapsed = time.perf_counter() - start
+
+    scored = int(result['rain_prob'].notna().sum())
+    print(f"✅ Scored {scored}/{len(df)} points in {elapsed:.2f}s "
+          f"({len(df) / elapsed:.0f} points/s) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,153 @@
+import os
+import glob
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 
 # --- CONFIGURATION ---
 LOG_FILE = r"C:\Users\nirad\Downloads\Clima_Route\AI_Model\training_log.csv"
+RUNS_FILE = os.path.join(os.path.dirname(LOG_FILE), 'training_runs.csv')
+OUTPUT_FILE = 'accuracy_graph.png'
 
-def plot_performance():
-    print("Reading training logs...")
+# Columns written by PerfLogger in Trained_model.py (older logs don't have them)
+PERF_PANELS = [
+    ('epoch_time_s', 'Epoch Wall Time', 'Seconds'),
+    ('samples_per_sec', 'Training Throughput', 'Samples / second'),
+    ('peak_rss_mb', 'Peak Memory (RSS)', 'MB'),
+]
+
+def load_logs(paths):
+    """Read each training log (glob patterns allowed); returns [(label, DataFrame)]"""
+    runs = []
+    expanded = [match for path in paths for match in (sorted(glob.glob(path)) or [path])]
+    for path in expanded:
+        try:
+            runs.append((os.path.splitext(os.path.basename(path))[0], pd.read_csv(path)))
+        except FileNotFoundError:
+            print(f"Error: Could not find '{path}'. Did you run Trained_model.py first?")
+    return runs
+
+def load_run_summary(path):
+    """Per-run preprocessing/fit durations written by Trained_model.py (None if absent)"""
     try:
-        # Read the CSV file created by the training script
-        data = pd.read_csv(LOG_FILE)
+        return pd.read_csv(path)
     except FileNotFoundError:
-        print("Error: Could not find 'training_log.csv'. Did you run train_model.py first?")
+        print(f"Note: '{path}' not found, skipping the preprocessing panel.")
+        return None
+
+def plot_performance(paths, runs_file=RUNS_FILE):
+    print("Reading training logs...")
+    runs = load_logs(paths)
+    if not runs:
         return
+    summary_runs = load_run_summary(runs_file)
 
-    epochs = range(1, len(data) + 1)
-    
     # Create a nice wide figure
-    plt.figure(figsize=(14, 6))
-    
+    fig, axes = plt.subplots(2, 4, figsize=(24, 10))
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+
     # --- GRAPH 1: ACCURACY ---
-    plt.subplot(1, 2, 1)
-    plt.plot(epochs, data['accuracy'], label='Training Accuracy', color='blue', linewidth=2)
-    plt.plot(epochs, data['val_accuracy'], label='Validation Accuracy', color='orange', linestyle='--', linewidth=2)
-    plt.title('Model Accuracy over Time')
-    plt.xlabel('Epochs')
-    plt.ylabel('Accuracy')
-    plt.legend()
-    plt.grid(True)
-  
+    ax = axes[0, 0]
+    for i, (label, data) in enumerate(runs):
+        epochs = range(1, len(data) + 1)
+        color = colors[i % len(colors)]
+        ax.plot(epochs, data['accuracy'], label=f'{label} (train)', color=color, linewidth=2)
+        if 'val_accuracy' in data:
+            ax.plot(epochs, data['val_accuracy'], label=f'{label} (val)', color=color, linestyle='--', linewidth=2)
+    ax.set_title('Model Accuracy over Time')
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Accuracy')
+    ax.legend()
+    ax.grid(True)
+
+    # --- GRAPH 2: INPUT PIPELINE vs MODEL STEP ---
+    ax = axes[0, 1]
+    for i, (label, data) in enumerate(runs):
+        if 'step_time_s' not in data:
+            continue
+        epochs = range(1, len(data) + 1)
+        color = colors[i % len(colors)]
+        ax.plot(epochs, data['step_time_s'], label=f'{label} (model step)', color=color, linewidth=2)
+        ax.plot(epochs, data['input_time_s'], label=f'{label} (input pipeline)', color=color, linestyle=':', linewidth=2)
+        if 'loop_overhead_s' in data:
+            ax.plot(epochs, data['loop_overhead_s'], label=f'{label} (loop overhead)', color=color, linestyle='-.', linewidth=1)
+        ax.plot(epochs, data['val_time_s'], label=f'{label} (validation)', color=color, linestyle='--', linewidth=1)
+    ax.set_title('Where Epoch Time Goes')
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Seconds')
+    ax.grid(True)
+    if ax.lines:
+        ax.legend()
+
+    # --- GRAPHS 3-5: TIME, THROUGHPUT, MEMORY ---
+    for ax, (col, title, ylabel) in zip([axes[0, 2], axes[1, 0], axes[1, 1]], PERF_PANELS):
+        for i, (label, data) in enumerate(runs):
+            if col in data:
+                ax.plot(range(1, len(data) + 1), data[col], label=label,
+                        color=colors[i % len(colors)], marker='o', linewidth=2)
+        ax.set_title(title)
+        ax.set_xlabel('Epochs')
+        ax.set_ylabel(ylabel)
+        ax.grid(True)
+        if ax.lines:
+            ax.legend()
+
+    # --- GRAPH 6: RUN SUMMARY (spot regressions between runs) ---
+    ax = axes[1, 2]
+    summary = [(label, data) for label, data in runs if 'samples_per_sec' in data]
+    if summary:
+        labels = [label for label, _ in summary]
+        ax.bar(labels, [data['samples_per_sec'].median() for _, data in summary],
+               color=[colors[i % len(colors)] for i in range(len(summary))])
+        ax.set_ylabel('Median samples / second')
+        ax.tick_params(axis='x', rotation=20)
+    ax.set_title('Throughput per Run')
+    ax.grid(True, axis='y')
+
+    # --- GRAPH 7: PREPROCESSING + FIT TIME PER RUN (training_runs.csv) ---
+    ax = axes[0, 3]
+    if summary_runs is not None and len(summary_runs):
+        # Plot by position: a run id can repeat (e.g. an incremental run that fell back to full)
+        x = range(len(summary_runs))
+        labels = summary_runs['run_id'].astype(str) + ' ' + summary_runs['mode']
+        bottom = None
+        for col, name in [('load_s', 'load CSV'), ('scale_s', 'scale'), ('sequences_s', 'build sequences')]:
+            ax.bar(x, summary_runs[col], bottom=bottom, label=name)
+            bottom = summary_runs[col] if bottom is None else bottom + summary_runs[col]
+        ax.set_xticks(list(x), labels, rotation=45)
+        ax.legend()
+    ax.set_title('Preprocessing Time per Run')
+    ax.set_ylabel('Seconds')
+    ax.grid(True, axis='y')
+
+    # --- GRAPH 8: FIT TIME + PEAK MEMORY PER RUN ---
+    ax = axes[1, 3]
+    if summary_runs is not None and len(summary_runs):
+        x = range(len(summary_runs))
+        labels = summary_runs['run_id'].astype(str) + ' ' + summary_runs['mode']
+        ax.plot(x, summary_runs['fit_s'], marker='o', linewidth=2, label='fit (s)')
+        ax.set_ylabel('Fit seconds')
+        mem_ax = ax.twinx()
+        mem_ax.plot(x, summary_runs['peak_rss_mb'], marker='s', color='gray', linestyle='--', label='peak RSS (MB)')
+        mem_ax.set_ylabel('Peak RSS (MB)')
+        ax.set_xticks(list(x), labels, rotation=45)
+        ax.legend(loc='upper left')
+        mem_ax.legend(loc='upper right')
+    ax.set_title('Fit Time & Peak Memory per Run')
+    ax.grid(True)
+
     # Save to file
-    plt.tight_layout()
-    plt.savefig('accuracy_graph.png')
-    print("Success! Graph saved as 'accuracy_graph.png'. Check your folder.")
-    
+    fig.tight_layout()
+    fig.savefig(OUTPUT_FILE)
+    print(f"Success! Graph saved as '{OUTPUT_FILE}'. Check your folder.")
+
     # Show on screen (optional)
     plt.show()
 
 if __name__ == "__main__":
-    plot_performance()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Plot accuracy and training performance from one or more training logs')
+    parser.add_argument('logs', nargs='*', default=[LOG_FILE],
+                        help='training_log.csv files (or glob patterns, e.g. "training_logs/*.csv") to compare')
+    parser.add_argument('--runs', default=RUNS_FILE, help='training_runs.csv with per-run preprocessing times')
+    args = parser.parse_args()
+    plot_performance(args.logs, args.runs)
@@ -0,0 +1,64 @@
+"""
+Gunicorn config for the AI service (preload mode)
+
+The master process imports main.py (and with it TensorFlow) and unpickles
+the scaler BEFORE forking, so every worker shares those pages copy-on-write
+instead of paying for its own copy.
+
+TensorFlow's runtime is not fork-safe: once an op has run, its thread pools
+live in the master and are dead in the children. The Keras model itself is
+therefore loaded and warmed in post_fork (per worker), reading the .keras
+file from the already-shared page cache. The TF thread pools are sized in
+post_fork too, in both modes, so preload on/off differ only in what is shared.
+
+Environment:
+    WEB_CONCURRENCY     number of workers (default 4)
+    PRELOAD_MODEL       "0" to disable preloading (each worker imports TF and loads everything)
+    TF_INTRA_OP_THREADS override intra-op threads per worker (default cores // workers)
+    TF_INTER_OP_THREADS override inter-op threads per worker (default 1)
+"""
+
+import gc
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+preload_app = os.environ.get("PRELOAD_MODEL", "1") != "0"
+timeout = 120  # first worker boot includes model load + warm-up
+
+
+def _threads_per_worker(server):
+    """Split the available cores evenly between workers"""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    intra = int(os.environ.get("TF_INTRA_OP_THREADS", max(1, cores // server.cfg.workers)))
+    inter = int(os.environ.get("TF_INTER_OP_THREADS", 1))
+    return intra, inter
+
+
+def on_starting(server):
+    """Runs in the master after preload_app imported main.py, before any fork"""
+    if not server.cfg.preload_app:
+        return
+    import main
+
+    main.load_scaler()
+
+    # Move everything allocated so far out of the GC's reach, so collections in
+    # the workers don't touch (and un-share) the master's objects
+    gc.freeze()
+    server.log.info(f"Preloaded TensorFlow + scaler in master (pid {os.getpid()})")
+
+
+def post_fork(server, worker):
+    """Runs in each worker right after fork: size TF threads, then materialise and warm the model"""
+    import main
+
+    # Both modes: no TF op has run in this process yet, so the setting still applies
+    intra, inter = _threads_per_worker(server)
+    main.configure_threading(intra, inter)
+    if not server.cfg.preload_app:
+        return  # the app's lifespan loads the model
+
+    if main.load_model_store():
+        server.log.info(f"Worker ready (pid {worker.pid})")
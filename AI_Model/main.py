@@ -4,11 +4,18 @@ Production-Ready AI Weather Prediction Service
 - Health checks for container orchestration
 - Proper error handling and logging
 - Thread-safe for multiple concurrent users
+- Admission control: caps in-flight work per worker, honours the client's
+  X-Request-Deadline-Ms budget and sheds load (503 + Retry-After) early
 """
 
 import os
+import math
+import time
+import asyncio
 import logging
+import threading
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Optional, List
 from datetime import datetime
 
@@ -16,11 +23,15 @@ import numpy as np
 import pandas as pd
 import requests
 import joblib
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from tensorflow.keras.models import load_model
 
+import bulk_score
+
 # --- LOGGING SETUP ---
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +44,22 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(BASE_DIR, 'rainfall_model.keras'))
 SCALER_PATH = os.environ.get('SCALER_PATH', os.path.join(BASE_DIR, 'scaler.gz'))
 
+# Admission control (per worker process)
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 8))  # concurrent requests doing work
+MAX_QUEUED = int(os.environ.get('MAX_QUEUED', MAX_IN_FLIGHT * 4))  # requests waiting for a slot
+DEFAULT_DEADLINE_MS = int(os.environ.get('DEFAULT_DEADLINE_MS', 15000))  # when the client sends none
+MAX_DEADLINE_MS = int(os.environ.get('MAX_DEADLINE_MS', 60000))  # longer client budgets are capped
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'  # remaining budget in ms, relative (no clock skew)
+ADMISSION_EXEMPT = {'/health', '/ready', '/metrics'}
+# /bulk_score runs for seconds to minutes: own slots, queue and service-time estimate,
+# so it never holds a slot or skews the queue estimate of single-point requests
+BULK_PATHS = {'/bulk_score'}
+BULK_MAX_IN_FLIGHT = int(os.environ.get('BULK_MAX_IN_FLIGHT', 1))
+BULK_MAX_QUEUED = int(os.environ.get('BULK_MAX_QUEUED', 2))
+BULK_DEFAULT_DEADLINE_MS = int(os.environ.get('BULK_DEFAULT_DEADLINE_MS', 120000))
+BULK_MAX_DEADLINE_MS = int(os.environ.get('BULK_MAX_DEADLINE_MS', 600000))
+WEATHER_TIMEOUT = 10
+
 FEATURE_COLS = [
     'temperature_2m', 'relative_humidity_2m', 'dew_point_2m',
     'surface_pressure', 'cloud_cover', 'wind_speed_10m',
@@ -65,22 +92,56 @@ class HealthResponse(BaseModel):
     model_loaded: bool
     message: str
 
-# --- STARTUP/SHUTDOWN LIFECYCLE ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Load model ONCE at startup, cleanup on shutdown"""
-    logger.info("⏳ Loading AI Model at startup...")
-    
+# --- MODEL LOADING ---
+def configure_threading(intra_op: int, inter_op: int):
+    """Size TensorFlow's thread pools (must run before the first TF op)"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    logger.info(f"🧵 TF threads: intra_op={intra_op}, inter_op={inter_op}")
+
+def load_scaler() -> bool:
+    """Load the scaler into the model store (fork-safe, plain Python objects)"""
+    if model_store.scaler is not None:
+        return True
+    if not os.path.exists(SCALER_PATH):
+        logger.error(f"❌ Scaler file not found: {SCALER_PATH}")
+        return False
+    model_store.scaler = joblib.load(SCALER_PATH)
+    return True
+
+def load_model_store() -> bool:
+    """Load model & scaler into the global store, then warm the model up"""
+    if model_store.is_loaded:
+        return True
     try:
-        if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH):
+        if os.path.exists(MODEL_PATH) and load_scaler():
             model_store.model = load_model(MODEL_PATH)
-            model_store.scaler = joblib.load(SCALER_PATH)
+            warm_up_model()
             model_store.is_loaded = True
             logger.info("✅ Model & Scaler loaded successfully!")
         else:
             logger.error(f"❌ Model files not found: {MODEL_PATH}, {SCALER_PATH}")
     except Exception as e:
         logger.error(f"❌ Error loading model: {e}")
+    return model_store.is_loaded
+
+def warm_up_model():
+    """Run one dummy prediction so the first real request skips graph tracing"""
+    dummy = np.zeros((1, 24, len(FEATURE_COLS)), dtype=np.float32)
+    try:
+        model_store.model.predict(dummy, verbose=0)
+    except Exception:
+        model_store.model.predict(dummy[:, -1, :], verbose=0)
+
+# --- STARTUP/SHUTDOWN LIFECYCLE ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load model ONCE at startup (no-op if gunicorn already loaded it), cleanup on shutdown"""
+    if not model_store.is_loaded:
+        logger.info("⏳ Loading AI Model at startup...")
+        if load_model_store():
+            logger.info(f"Worker ready (pid {os.getpid()})")
     
     yield  # App runs here
     
@@ -88,6 +149,7 @@ async def lifespan(app: FastAPI):
     logger.info("🛑 Shutting down AI service...")
     model_store.model = None
     model_store.scaler = None
+    model_store.is_loaded = False
 
 # --- FASTAPI APP ---
 app = FastAPI(
@@ -97,6 +159,139 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# --- ADMISSION CONTROL / LOAD SHEDDING ---
+# Absolute time.monotonic() deadline of the current request (None = no deadline)
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+class AdmissionStats:
+    """Per-worker counters, exposed on /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0                  # rejected with 503 before doing any work
+        self.deadline_misses = 0       # deadline passed while queued or before the response
+        self.upstream_skipped = 0      # weather fetches (locations) skipped, deadline already gone
+
+    def incr(self, name: str, by: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + by)
+
+class AdmissionLane:
+    """Slots and queue for one class of requests, with its own service-time estimate
+    (only touched from the worker's event loop)"""
+
+    def __init__(self, max_in_flight: int, max_queued: int, default_deadline_ms: int, max_deadline_ms: int):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.default_deadline_ms = default_deadline_ms
+        self.max_deadline_ms = max_deadline_ms
+        self.queued = 0
+        self.avg_service_time = None   # EWMA of admitted request duration (seconds)
+        self._slots = None             # asyncio.Semaphore, created lazily inside the event loop
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+
+    def record_service_time(self, seconds: float):
+        if self.avg_service_time is None:
+            self.avg_service_time = seconds
+        else:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * seconds
+
+    def expected_wait(self) -> float:
+        """Rough queueing delay for a new arrival: full 'rounds' of slots ahead of it"""
+        if self.avg_service_time is None:
+            return 0.0
+        return (self.queued // self.max_in_flight + 1) * self.avg_service_time
+
+admission = AdmissionStats()
+lanes = {
+    'default': AdmissionLane(MAX_IN_FLIGHT, MAX_QUEUED, DEFAULT_DEADLINE_MS, MAX_DEADLINE_MS),
+    'bulk': AdmissionLane(BULK_MAX_IN_FLIGHT, BULK_MAX_QUEUED, BULK_DEFAULT_DEADLINE_MS, BULK_MAX_DEADLINE_MS),
+}
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left for the current request, or None if it has no deadline"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def deadline_passed() -> bool:
+    remaining = deadline_remaining()
+    return remaining is not None and remaining <= 0
+
+def shed_response(reason: str, retry_after: float) -> JSONResponse:
+    admission.incr('shed')
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Service overloaded: {reason}"},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+async def admission_control(request: Request, call_next):
+    """Cap in-flight work per worker and shed requests that cannot meet their deadline"""
+    if request.url.path in ADMISSION_EXEMPT:
+        return await call_next(request)
+    lane = lanes['bulk' if request.url.path in BULK_PATHS else 'default']
+
+    try:
+        budget_ms = float(request.headers.get(DEADLINE_HEADER, lane.default_deadline_ms))
+    except ValueError:
+        budget_ms = lane.default_deadline_ms
+    # nan would slip past every comparison below (and into the event loop's timer heap)
+    if not math.isfinite(budget_ms):
+        budget_ms = lane.default_deadline_ms
+    budget = min(budget_ms, lane.max_deadline_ms) / 1000
+    arrived = time.monotonic()
+    deadline = arrived + budget
+
+    if budget <= 0:
+        admission.incr('deadline_misses')
+        return shed_response("deadline already expired", 1)
+
+    if lane.slots.locked():
+        # No free slot: only queue if we can plausibly start before the deadline
+        wait = lane.expected_wait()
+        if lane.queued >= lane.max_queued:
+            return shed_response("queue full", wait)
+        if wait > budget:
+            return shed_response("expected queue wait exceeds deadline", wait)
+
+    lane.queued += 1
+    admission.incr('queued')
+    try:
+        await asyncio.wait_for(lane.slots.acquire(), timeout=budget)
+    except asyncio.TimeoutError:
+        admission.incr('deadline_misses')
+        return shed_response("deadline passed while queued", lane.expected_wait())
+    finally:
+        lane.queued -= 1
+        admission.incr('queued', -1)
+
+    admission.incr('admitted')
+    admission.incr('in_flight')
+    started = time.monotonic()
+    token = request_deadline.set(deadline)
+    try:
+        response = await call_next(request)
+    finally:
+        request_deadline.reset(token)
+        admission.incr('in_flight', -1)
+        lane.slots.release()
+        lane.record_service_time(time.monotonic() - started)
+
+    if time.monotonic() > deadline:
+        admission.incr('deadline_misses')
+    return response
+
+# Registered before CORS so that CORS stays outermost and 503s keep their headers
+app.middleware("http")(admission_control)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -119,14 +314,26 @@ def get_real_weather(lat: float, lon: float) -> Optional[dict]:
         "forecast_days": 1,
         "timezone": "auto"
     }
+    # Don't start an upstream call the client will never wait for
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        admission.incr('upstream_skipped')
+        logger.warning(f"Skipping weather fetch for ({lat}, {lon}): deadline passed")
+        return None
+    timeout = WEATHER_TIMEOUT if remaining is None else min(WEATHER_TIMEOUT, remaining)
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = requests.get(url, params=params, timeout=timeout)
         response.raise_for_status()
         return response.json()
     except Exception as e:
         logger.error(f"Weather API error: {e}")
         return None
 
+def raise_if_deadline_passed():
+    """Turn a failure caused by an expired client deadline into a 504"""
+    if deadline_passed():
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
 def get_weather_desc(code: int) -> str:
     """Convert weather code to description"""
     if code in [0, 1, 2]:
@@ -206,12 +413,32 @@ async def readiness_check():
         raise HTTPException(status_code=503, detail="Model not ready")
     return {"status": "ready"}
 
+@app.get("/metrics")
+async def metrics():
+    """Admission control counters for this worker process"""
+    return {
+        "pid": os.getpid(),
+        "max_in_flight": MAX_IN_FLIGHT,
+        "max_queued": MAX_QUEUED,
+        "in_flight": admission.in_flight,
+        "queued": admission.queued,
+        "admitted": admission.admitted,
+        "shed": admission.shed,
+        "deadline_misses": admission.deadline_misses,
+        "upstream_skipped": admission.upstream_skipped,
+        "avg_service_time_ms": {
+            name: None if lane.avg_service_time is None else round(lane.avg_service_time * 1000, 1)
+            for name, lane in lanes.items()
+        }
+    }
+
 @app.post("/predict_score")
 async def predict_score(request: LocationRequest):
     """Used by RouteController for path scoring"""
-    result = calculate_risk(request.latitude, request.longitude)
+    result = await run_in_threadpool(calculate_risk, request.latitude, request.longitude)
     
     if not result:
+        raise_if_deadline_passed()
         raise HTTPException(status_code=500, detail="Weather API failed")
     
     return {
@@ -223,9 +450,10 @@ async def predict_score(request: LocationRequest):
 @app.post("/weather_details")
 async def weather_details(request: LocationRequest):
     """Used by WeatherController for frontend display"""
-    result = calculate_risk(request.latitude, request.longitude)
+    result = await run_in_threadpool(calculate_risk, request.latitude, request.longitude)
     
     if not result:
+        raise_if_deadline_passed()
         raise HTTPException(status_code=500, detail="Failed to analyze")
 
     prob = result['rain_probability']
@@ -252,7 +480,8 @@ async def segment_weather(request: SegmentsRequest):
     
     results = []
     for seg in request.segments:
-        weather_result = calculate_risk(seg.lat, seg.lon)
+        # Past the deadline get_real_weather skips the fetch, so remaining segments drop out
+        weather_result = await run_in_threadpool(calculate_risk, seg.lat, seg.lon)
         
         if weather_result:
             rain_prob = weather_result['rain_probability']
@@ -282,6 +511,51 @@ async def segment_weather(request: SegmentsRequest):
     
     return {"segments": results}
 
+@app.post("/bulk_score")
+async def bulk_score_endpoint(request: Request):
+    """Score many points at once; body and response are Parquet, Arrow IPC stream or msgpack"""
+    fmt = bulk_score.format_from_content_type(request.headers.get('content-type'))
+    if fmt is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Content-Type must be one of: {', '.join(bulk_score.CONTENT_TYPES.values())}"
+        )
+    if not model_store.is_loaded:
+        raise HTTPException(status_code=503, detail="Model not ready")
+
+    # Cap the body before buffering it: Content-Length first, then while streaming
+    too_large = f"Body exceeds {bulk_score.MAX_BODY_BYTES} bytes"
+    try:
+        content_length = int(request.headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > bulk_score.MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=too_large)
+    payload = bytearray()
+    async for chunk in request.stream():
+        payload += chunk
+        if len(payload) > bulk_score.MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=too_large)
+
+    try:
+        # Fetching + batch inference block, keep them off the event loop. The deadline is
+        # passed explicitly: bulk_score's fetch threads don't see this request's context.
+        content, points, rate, skipped = await run_in_threadpool(
+            bulk_score.score_bytes, bytes(payload), fmt, model_store.model, model_store.scaler,
+            request_deadline.get()
+        )
+        admission.incr('upstream_skipped', skipped)
+    except bulk_score.BulkTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except bulk_score.BulkInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return Response(
+        content=content,
+        media_type=bulk_score.CONTENT_TYPES[fmt],
+        headers={"X-Points": str(points), "X-Points-Per-Second": f"{rate:.1f}"}
+    )
+
 # --- RUN WITH UVICORN (Production ASGI Server) ---
 if __name__ == "__main__":
     import uvicorn
@@ -4,16 +4,30 @@ Database Migration Script: SQLite → PostgreSQL
 This script exports data from SQLite and imports into PostgreSQL.
 Run this ONCE during migration.
 
+Sync mode (--sync) can be run repeatedly while the app stays online: it
+copies only rows added since the last run (per-table rowid watermark),
+then compares key ranges by row count + checksum, both computed inside
+SQLite and PostgreSQL, and only reads and fixes ranges that differ. The
+final cutover run then only has to copy the last few seconds of changes.
+
 Usage:
     python migrate_db.py --sqlite-path ./climaroute.db --pg-host localhost --pg-db climaroute
+    python migrate_db.py --sqlite-path ./climaroute.db --pg-host localhost --pg-db climaroute --sync
 """
 
 import argparse
+import hashlib
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_batch, execute_values
 from datetime import datetime
 
+STATE_TABLE = '_migration_sync_state'
+
 def get_sqlite_tables(sqlite_conn):
     """Get list of tables from SQLite"""
     cursor = sqlite_conn.cursor()
@@ -38,27 +52,32 @@ def sqlite_to_pg_type(sqlite_type):
     }
     return type_map.get(sqlite_type.upper(), 'TEXT')
 
+def get_primary_key(columns):
+    """Primary key column names, in key order"""
+    return [name for name, _, pk_pos in sorted(columns, key=lambda c: c[2]) if pk_pos]
+
+def build_create_sql(table_name, columns):
+    """CREATE TABLE statement for PostgreSQL (supports composite keys)"""
+    col_defs = [f'"{name}" {sqlite_to_pg_type(dtype)}' for name, dtype, _ in columns]
+    pk_cols = get_primary_key(columns)
+    if pk_cols:
+        col_defs.append(f'PRIMARY KEY ({", ".join(quote_cols(pk_cols))})')
+    return f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(col_defs)})'
+
+def quote_cols(names):
+    return [f'"{name}"' for name in names]
+
 def migrate_table(sqlite_conn, pg_conn, table_name):
     """Migrate a single table from SQLite to PostgreSQL"""
     print(f"  📦 Migrating table: {table_name}")
     
     # Get schema
     schema = get_table_schema(sqlite_conn, table_name)
-    columns = [(col[1], col[2], col[5]) for col in schema]  # name, type, is_pk
+    columns = [(col[1], col[2], col[5]) for col in schema]  # name, type, pk position
     
     # Create PostgreSQL table
     pg_cursor = pg_conn.cursor()
-    
-    # Build CREATE TABLE statement
-    col_defs = []
-    for name, dtype, is_pk in columns:
-        pg_type = sqlite_to_pg_type(dtype)
-        col_def = f'"{name}" {pg_type}'
-        if is_pk:
-            col_def += ' PRIMARY KEY'
-        col_defs.append(col_def)
-    
-    create_sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(col_defs)})'
+    create_sql = build_create_sql(table_name, columns)
     
     try:
         pg_cursor.execute(f'DROP TABLE IF EXISTS "{table_name}" CASCADE')
@@ -81,7 +100,7 @@ def migrate_table(sqlite_conn, pg_conn, table_name):
     # Insert into PostgreSQL
     col_names = [col[0] for col in columns]
     placeholders = ', '.join(['%s'] * len(col_names))
-    insert_sql = f'INSERT INTO "{table_name}" ({", ".join([f\'"{c}\'' for c in col_names])}) VALUES ({placeholders})'
+    insert_sql = f'INSERT INTO "{table_name}" ({", ".join(quote_cols(col_names))}) VALUES ({placeholders})'
     
     try:
         execute_batch(pg_cursor, insert_sql, rows, page_size=1000)
@@ -93,6 +112,310 @@ def migrate_table(sqlite_conn, pg_conn, table_name):
         pg_conn.rollback()
         return 0
 
+# --- SYNC MODE (incremental, repeatable) ---
+def ensure_state_table(pg_conn):
+    cursor = pg_conn.cursor()
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{STATE_TABLE}" '
+        '(table_name TEXT PRIMARY KEY, last_rowid BIGINT NOT NULL, synced_at TIMESTAMP NOT NULL)'
+    )
+    pg_conn.commit()
+
+def get_watermark(pg_conn, table_name):
+    cursor = pg_conn.cursor()
+    cursor.execute(f'SELECT last_rowid FROM "{STATE_TABLE}" WHERE table_name = %s', (table_name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def set_watermark(pg_cursor, table_name, last_rowid):
+    """Store the watermark (caller commits, together with the rows it covers)"""
+    pg_cursor.execute(
+        f'INSERT INTO "{STATE_TABLE}" (table_name, last_rowid, synced_at) VALUES (%s, %s, %s) '
+        'ON CONFLICT (table_name) DO UPDATE SET last_rowid = EXCLUDED.last_rowid, synced_at = EXCLUDED.synced_at',
+        (table_name, last_rowid, datetime.now())
+    )
+
+def build_upsert_sql(table_name, col_names, pk_cols):
+    """INSERT ... ON CONFLICT DO UPDATE for execute_values"""
+    updates = [f'"{c}" = EXCLUDED."{c}"' for c in col_names if c not in pk_cols]
+    conflict = 'DO UPDATE SET ' + ', '.join(updates) if updates else 'DO NOTHING'
+    return (f'INSERT INTO "{table_name}" ({", ".join(quote_cols(col_names))}) VALUES %s '
+            f'ON CONFLICT ({", ".join(quote_cols(pk_cols))}) {conflict}')
+
+# --- Chunk checksums, computed inside each database ---
+# Both sides render a row as the same text (per PostgreSQL column type) and md5 it.
+# A chunk's checksum is the sum of the first 60 bits of its row hashes: the sum is
+# order independent, so the two databases never have to agree on row order.
+ROW_SEPARATOR = '\x1f'
+NULL_TEXT = '\\N'
+TYPE_CODES = {'INTEGER': 'i', 'DOUBLE PRECISION': 'f', 'NUMERIC': 'f', 'BYTEA': 'b'}  # anything else: text
+
+def type_codes(columns):
+    """One letter per column telling the SQLite hash functions how PostgreSQL renders it"""
+    return ''.join(TYPE_CODES.get(sqlite_to_pg_type(dtype), 't') for _, dtype, _ in columns)
+
+def canonical_value(value, code):
+    """SQLite value rendered exactly like pg_canonical_sql renders the PostgreSQL column"""
+    if value is None:
+        return NULL_TEXT
+    if code == 'b':
+        return (value if isinstance(value, bytes) else str(value).encode()).hex()
+    if code == 'f' and isinstance(value, (int, float)):
+        if value == 0:
+            return '0'  # numeric has no negative zero
+        # float8::numeric keeps 15 significant digits and never prints an exponent
+        return format(Decimal('%.15g' % value), 'f')
+    return str(value)
+
+def sqlite_row_hash(codes, *row):
+    text = ROW_SEPARATOR.join(canonical_value(v, c) for v, c in zip(row, codes))
+    return hashlib.md5(text.encode()).hexdigest()
+
+class SqliteChunkChecksum:
+    """SQLite aggregate matching pg_chunk_checksum_sql"""
+
+    def __init__(self):
+        self.total = 0
+
+    def step(self, codes, *row):
+        self.total += int(sqlite_row_hash(codes, *row)[:15], 16)
+
+    def finalize(self):
+        return str(self.total)  # can exceed SQLite's 64-bit integers
+
+def register_sqlite_functions(sqlite_conn):
+    sqlite_conn.create_function('sync_row_hash', -1, sqlite_row_hash, deterministic=True)
+    sqlite_conn.create_aggregate('sync_chunk_checksum', -1, SqliteChunkChecksum)
+
+def pg_canonical_sql(name, code):
+    if code == 'b':
+        expr = f'encode("{name}", \'hex\')'
+    elif code == 'f':
+        expr = f'"{name}"::float8::numeric::text'
+    else:
+        expr = f'"{name}"::text'
+    return f"coalesce({expr}, '{NULL_TEXT}')"
+
+def pg_row_hash_sql(col_names, codes):
+    parts = ', '.join(pg_canonical_sql(name, code) for name, code in zip(col_names, codes))
+    return f'md5(concat_ws(chr(31), {parts}))'
+
+def pg_chunk_checksum_sql(col_names, codes):
+    return f"coalesce(sum(('x' || left({pg_row_hash_sql(col_names, codes)}, 15))::bit(60)::bigint), 0)"
+
+def key_range_sql(pk_cols, pk_codes, lo, hi, pg):
+    """WHERE clause for lo <= key < hi (None = unbounded) that orders keys the same way
+    in both databases: bytewise (SQLite BINARY, PostgreSQL "C" collation)"""
+    if pg:
+        cols = [f'"{c}" COLLATE "C"' if code == 't' else f'"{c}"' for c, code in zip(pk_cols, pk_codes)]
+        mark = '%s'
+    else:
+        cols = [f'"{c}" COLLATE BINARY' for c in pk_cols]
+        mark = '?'
+    key = cols[0] if len(cols) == 1 else f'({", ".join(cols)})'
+    value = mark if len(cols) == 1 else f'({", ".join([mark] * len(cols))})'
+    clauses, params = [], []
+    if lo is not None:
+        clauses.append(f'{key} >= {value}')
+        params += lo
+    if hi is not None:
+        clauses.append(f'{key} < {value}')
+        params += hi
+    return ' AND '.join(clauses) or '1 = 1', params
+
+def chunk_ranges(sqlite_conn, table_name, pk_cols, chunk_size):
+    """Split the key space at every chunk_size-th SQLite key (one key-only scan of the
+    local file). The first and last ranges are open so they also cover PostgreSQL keys
+    that no longer exist in SQLite."""
+    key_sql = ", ".join(f'"{c}" COLLATE BINARY' for c in pk_cols)
+    cursor = sqlite_conn.cursor()
+    cursor.execute(f'SELECT {", ".join(quote_cols(pk_cols))} FROM "{table_name}" ORDER BY {key_sql}')
+    bounds = [None]
+    for i, key in enumerate(cursor):
+        if i and i % chunk_size == 0:
+            bounds.append(key)
+    bounds.append(None)
+    return list(zip(bounds, bounds[1:]))
+
+class SyncWorkerPool:
+    """Thread pool where every thread keeps its own SQLite + PostgreSQL connection"""
+
+    def __init__(self, sqlite_path, pg_params, workers):
+        self.sqlite_path = sqlite_path
+        self.pg_params = pg_params
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def connections_for_thread(self):
+        if not hasattr(self.local, 'sqlite_conn'):
+            self.local.sqlite_conn = sqlite3.connect(self.sqlite_path)
+            register_sqlite_functions(self.local.sqlite_conn)
+            self.local.pg_conn = psycopg2.connect(**self.pg_params)
+            with self.lock:
+                self.connections += [self.local.sqlite_conn, self.local.pg_conn]
+        return self.local.sqlite_conn, self.local.pg_conn
+
+    def map(self, fn, items):
+        return list(self.executor.map(lambda item: fn(*self.connections_for_thread(), item), items))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for conn in self.connections:
+            conn.close()
+
+def verify_chunk(sqlite_conn, pg_conn, job):
+    """Compare one key range by key count + checksum, both computed in the database.
+    Only a mismatched range is fetched and fixed. Returns (upserted, deleted), or None
+    when the range already matched."""
+    table_name, col_names, codes, pk_cols, lo, hi = job
+    pk_idx = [col_names.index(c) for c in pk_cols]
+    pk_codes = [codes[i] for i in pk_idx]
+    cols_sql = ", ".join(quote_cols(col_names))
+    sqlite_where, sqlite_params = key_range_sql(pk_cols, pk_codes, lo, hi, pg=False)
+    pg_where, pg_params = key_range_sql(pk_cols, pk_codes, lo, hi, pg=True)
+
+    sqlite_cursor = sqlite_conn.cursor()
+    sqlite_cursor.execute(
+        f'SELECT count(*), sync_chunk_checksum(?, {cols_sql}) FROM "{table_name}" WHERE {sqlite_where}',
+        [codes] + sqlite_params
+    )
+    source_count, source_sum = sqlite_cursor.fetchone()
+    pg_cursor = pg_conn.cursor()
+    pg_cursor.execute(
+        f'SELECT count(*), {pg_chunk_checksum_sql(col_names, codes)} FROM "{table_name}" WHERE {pg_where}',
+        pg_params
+    )
+    target_count, target_sum = pg_cursor.fetchone()
+    if source_count == target_count and int(source_sum or 0) == int(target_sum):
+        pg_conn.rollback()  # end the read transaction
+        return None
+
+    # Mismatch: diff this range row by row
+    sqlite_cursor.execute(f'SELECT {cols_sql} FROM "{table_name}" WHERE {sqlite_where}', sqlite_params)
+    source = {tuple(row[i] for i in pk_idx): row for row in sqlite_cursor.fetchall()}
+    pg_cursor.execute(
+        f'SELECT {", ".join(quote_cols(pk_cols))}, {pg_row_hash_sql(col_names, codes)} '
+        f'FROM "{table_name}" WHERE {pg_where}',
+        pg_params
+    )
+    target = {tuple(row[:-1]): row[-1] for row in pg_cursor.fetchall()}
+
+    changed = [row for key, row in source.items() if target.get(key) != sqlite_row_hash(codes, *row)]
+    removed = [key for key in target if key not in source]
+    if changed:
+        execute_values(pg_cursor, build_upsert_sql(table_name, col_names, pk_cols), changed, page_size=1000)
+    if removed:
+        if len(pk_cols) == 1:
+            pg_cursor.execute(f'DELETE FROM "{table_name}" WHERE "{pk_cols[0]}" IN %s',
+                              (tuple(k[0] for k in removed),))
+        else:
+            pg_cursor.execute(f'DELETE FROM "{table_name}" WHERE ({", ".join(quote_cols(pk_cols))}) IN %s',
+                              (tuple(removed),))
+    pg_conn.commit()
+    return len(changed), len(removed)
+
+def replace_table(sqlite_conn, pg_conn, table_name, columns, batch_size):
+    """Full copy for tables without a primary key: fill a staging table, then swap it in.
+    Everything runs in one transaction, so readers keep seeing the old table until the
+    swap commits and a failed copy leaves it untouched."""
+    staging = f'{table_name}__sync_staging'
+    col_names = [col[0] for col in columns]
+    pg_cursor = pg_conn.cursor()
+    sqlite_cursor = sqlite_conn.cursor()
+    sqlite_cursor.execute(f'SELECT {", ".join(quote_cols(col_names))} FROM "{table_name}"')
+    copied = 0
+    try:
+        pg_cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        pg_cursor.execute(build_create_sql(staging, columns))
+        insert_sql = f'INSERT INTO "{staging}" ({", ".join(quote_cols(col_names))}) VALUES %s'
+        while True:
+            batch = sqlite_cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            execute_values(pg_cursor, insert_sql, batch, page_size=batch_size)
+            copied += len(batch)
+        # No CASCADE: if a view depends on the table, fail and keep the old one
+        pg_cursor.execute(f'DROP TABLE "{table_name}"')
+        pg_cursor.execute(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+        pg_conn.commit()
+    except Exception as e:
+        print(f"    ⚠️ Error replacing table: {e}")
+        pg_conn.rollback()
+        return 0
+    print(f"    ✓ Copied {copied} rows into a staging table and swapped it in")
+    return copied
+
+def sync_table(sqlite_conn, pg_conn, pool, table_name, batch_size, chunk_size):
+    """Incrementally sync one table; returns rows written (new + changed + deleted)"""
+    print(f"  🔄 Syncing table: {table_name}")
+    started = time.time()
+
+    schema = get_table_schema(sqlite_conn, table_name)
+    columns = [(col[1], col[2], col[5]) for col in schema]  # name, type, pk position
+    col_names = [col[0] for col in columns]
+    pk_cols = get_primary_key(columns)
+
+    pg_cursor = pg_conn.cursor()
+    try:
+        pg_cursor.execute(build_create_sql(table_name, columns))
+        pg_conn.commit()
+    except Exception as e:
+        print(f"    ⚠️ Error creating table: {e}")
+        pg_conn.rollback()
+        return 0
+
+    if not pk_cols:
+        # Without a key there is nothing to upsert on: recopy the table
+        print("    ⚠️ No primary key, recopying the whole table")
+        return replace_table(sqlite_conn, pg_conn, table_name, columns, batch_size)
+
+    upsert_sql = build_upsert_sql(table_name, col_names, pk_cols)
+    cols_sql = ", ".join(quote_cols(col_names))
+
+    # 1. New rows since the watermark, in batches (watermark committed with each batch)
+    watermark = get_watermark(pg_conn, table_name)
+    sqlite_cursor = sqlite_conn.cursor()
+    new_rows = 0
+    try:
+        sqlite_cursor.execute(
+            f'SELECT rowid, {cols_sql} FROM "{table_name}" WHERE rowid > ? ORDER BY rowid', (watermark,)
+        )
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID table: the checksum pass below copies what is missing
+        print("    ⚠️ No rowid, relying on chunk checksums only")
+        sqlite_cursor = None
+
+    while sqlite_cursor is not None:
+        batch = sqlite_cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        try:
+            execute_values(pg_cursor, upsert_sql, [row[1:] for row in batch], page_size=batch_size)
+            watermark = batch[-1][0]
+            set_watermark(pg_cursor, table_name, watermark)
+            pg_conn.commit()
+        except Exception as e:
+            print(f"    ⚠️ Error upserting rows: {e}")
+            pg_conn.rollback()
+            return new_rows
+        new_rows += len(batch)
+
+    # 2. Changed and deleted rows: per key range, compare count + checksum computed
+    #    in each database; only mismatched ranges are read and fixed (in parallel)
+    codes = type_codes(columns)
+    jobs = [(table_name, col_names, codes, pk_cols, lo, hi)
+            for lo, hi in chunk_ranges(sqlite_conn, table_name, pk_cols, chunk_size)]
+    fixed = [result for result in pool.map(verify_chunk, jobs) if result is not None]
+    changed_rows = sum(upserted for upserted, _ in fixed)
+    deleted_rows = sum(deleted for _, deleted in fixed)
+    print(f"    ✓ Verified {len(jobs)} chunks ({len(fixed)} mismatched)")
+
+    print(f"    ✓ {new_rows} new, {changed_rows} changed, {deleted_rows} deleted "
+          f"(watermark rowid {watermark}, {time.time() - started:.1f}s)")
+    return new_rows + changed_rows + deleted_rows
+
 def main():
     parser = argparse.ArgumentParser(description='Migrate SQLite to PostgreSQL')
     parser.add_argument('--sqlite-path', required=True, help='Path to SQLite database')
@@ -101,11 +424,15 @@ def main():
     parser.add_argument('--pg-db', default='climaroute', help='PostgreSQL database name')
     parser.add_argument('--pg-user', default='postgres', help='PostgreSQL user')
     parser.add_argument('--pg-password', default='postgres', help='PostgreSQL password')
+    parser.add_argument('--sync', action='store_true', help='Incremental sync instead of drop-and-copy (repeatable)')
+    parser.add_argument('--batch-size', default=1000, type=int, help='Rows per upsert batch (sync mode)')
+    parser.add_argument('--chunk-size', default=10000, type=int, help='Rows per checksum chunk (sync mode)')
+    parser.add_argument('--verify-workers', default=4, type=int, help='Parallel checksum workers (sync mode)')
     
     args = parser.parse_args()
     
     print("=" * 50)
-    print("🚀 SQLite → PostgreSQL Migration")
+    print("🔄 SQLite → PostgreSQL Sync" if args.sync else "🚀 SQLite → PostgreSQL Migration")
     print("=" * 50)
     print(f"Source: {args.sqlite_path}")
     print(f"Target: {args.pg_host}:{args.pg_port}/{args.pg_db}")
@@ -114,16 +441,18 @@ def main():
     # Connect to SQLite
     print("\n📂 Connecting to SQLite...")
     sqlite_conn = sqlite3.connect(args.sqlite_path)
+    register_sqlite_functions(sqlite_conn)
     
     # Connect to PostgreSQL
     print("🐘 Connecting to PostgreSQL...")
-    pg_conn = psycopg2.connect(
+    pg_params = dict(
         host=args.pg_host,
         port=args.pg_port,
         dbname=args.pg_db,
         user=args.pg_user,
         password=args.pg_password
     )
+    pg_conn = psycopg2.connect(**pg_params)
     
     # Get tables
     tables = get_sqlite_tables(sqlite_conn)
@@ -131,16 +460,28 @@ def main():
     
     # Migrate each table
     total_rows = 0
-    for table in tables:
-        rows = migrate_table(sqlite_conn, pg_conn, table)
-        total_rows += rows
+    if args.sync:
+        ensure_state_table(pg_conn)
+        pool = SyncWorkerPool(args.sqlite_path, pg_params, args.verify_workers)
+        try:
+            for table in tables:
+                total_rows += sync_table(sqlite_conn, pg_conn, pool, table, args.batch_size, args.chunk_size)
+        finally:
+            pool.close()
+    else:
+        for table in tables:
+            rows = migrate_table(sqlite_conn, pg_conn, table)
+            total_rows += rows
     
     # Cleanup
     sqlite_conn.close()
     pg_conn.close()
     
     print("\n" + "=" * 50)
-    print(f"✅ Migration complete! {total_rows} total rows migrated.")
+    if args.sync:
+        print(f"✅ Sync complete! {total_rows} total rows written.")
+    else:
+        print(f"✅ Migration complete! {total_rows} total rows migrated.")
     print("=" * 50)
 
 if __name__ == "__main__":